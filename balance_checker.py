@@ -1,68 +1,187 @@
 from dotenv import load_dotenv
 import os
 from binance.client import Client
+from binance import AsyncClient, BinanceSocketManager
+import asyncio
+import threading
 import time
 
 # Load .env file
 load_dotenv()
 
-def check_balance(api_key, api_secret):
+# Latest known balances per asset as (free, locked), kept current by the user data stream
+balances = {}
+
+# Stream events received while a REST snapshot is being taken, None once it is in place.
+# Starts as a buffer so events arriving before the first snapshot are not lost
+pending_events = []
+state_lock = threading.Lock()
+
+# Set while the user data stream is subscribed
+stream_ready = threading.Event()
+
+# Set when the stream dropped and came back, the balances must be reloaded
+resync_needed = threading.Event()
+
+# Seconds to wait for the user data stream to subscribe at startup
+STREAM_READY_TIMEOUT = 30
+
+# Seconds to wait before reopening a dropped user data stream
+RECONNECT_DELAY = 5
+
+def connect(api_key, api_secret):
+    """
+    Create the Binance client shared by every REST call of this script
+    """
     try:
         # Connect to Binance
         print("\nConnecting to Binance...")
-        client = Client(api_key, api_secret)
-        
-        try:
-            # Test connection
-            status = client.get_system_status()
-            print("Connection successful!")
-        except Exception as e:
-            print(f"Connection test failed: {e}")
-            return
-            
-        try:
-            # Get account information
-            print("Checking balance...")
-            account = client.get_account()
-            
-            # Print all balances that are greater than 0
-            print("\nYour current balances:")
-            print("----------------------")
-            found_balance = False
-            for balance in account['balances']:
-                free_balance = float(balance['free'])
-                locked_balance = float(balance['locked'])
-                if free_balance > 0 or locked_balance > 0:
-                    found_balance = True
-                    print(f"{balance['asset']}:")
-                    print(f"  Free: {free_balance}")
-                    print(f"  Locked: {locked_balance}")
-                    print("----------------------")
-            
-            if not found_balance:
-                print("No non-zero balances found.")
-                
-        except Exception as e:
-            print(f"Error getting account info: {e}")
-
+        return Client(api_key, api_secret)
     except Exception as e:
         print(f"Failed to initialize client: {e}")
+        return None
+
+def load_balances(client):
+    """
+    Replace the local balances with a REST snapshot. Stream events received
+    while it is taken are buffered and replayed on top of it, so the stream
+    must already be subscribed
+    """
+    global pending_events
+    with state_lock:
+        if pending_events is None:
+            pending_events = []
+
+    try:
+        # Get account information, this also confirms the connection and API keys work
+        print("Checking balance...")
+        account = client.get_account()
+    except Exception as e:
+        print(f"Error getting account info: {e}")
+        account = None
+
+    with state_lock:
+        if account is not None:
+            balances.clear()
+            for balance in account['balances']:
+                balances[balance['asset']] = (float(balance['free']), float(balance['locked']))
+        for msg in pending_events:
+            # Both times come from Binance, updates up to updateTime are already in the snapshot
+            if account is None or msg['u'] > account['updateTime']:
+                apply_event(msg)
+        pending_events = None
+
+    return account is not None
+
+def apply_event(msg):
+    """
+    Apply a balance change from the user data stream to the local balances dict
+    """
+    if msg['e'] == 'outboundAccountPosition':
+        for balance in msg['B']:
+            balances[balance['a']] = (float(balance['f']), float(balance['l']))
+
+def on_msg(msg):
+    """
+    Handle a user data stream event, buffering it while a snapshot is taken
+    """
+    if msg.get('e') != 'outboundAccountPosition':
+        return
+
+    with state_lock:
+        if pending_events is not None:
+            pending_events.append(msg)
+        else:
+            apply_event(msg)
+
+async def stream_user_data(api_key, api_secret):
+    """
+    Keep the user data stream subscribed and pass its events to on_msg. A
+    dropped stream is closed and opened again, and a resync is requested
+    since events were missed while it was down
+    """
+    global pending_events
+    client = await AsyncClient.create(api_key, api_secret)
+    bsm = BinanceSocketManager(client)
+    try:
+        while True:
+            try:
+                # Subscribes on enter, the listenKey is kept alive while inside
+                async with bsm.user_socket() as stream:
+                    stream_ready.set()
+                    while True:
+                        msg = await stream.recv()
+                        if msg.get('e') == 'error':
+                            print(f"\nUser data stream error: {msg.get('m')}")
+                            break
+                        on_msg(msg)
+            except Exception as e:
+                print(f"\nUser data stream error: {e}")
+
+            stream_ready.clear()
+            # Buffer from now on, the balances are reloaded once the stream is back
+            with state_lock:
+                if pending_events is None:
+                    pending_events = []
+            resync_needed.set()
+            await asyncio.sleep(RECONNECT_DELAY)
+    finally:
+        await client.close_connection()
+
+def check_balance():
+    """
+    Print all balances that are greater than 0 from the local balances dict
+    """
+    print("\nYour current balances:")
+    print("----------------------")
+    found_balance = False
+    with state_lock:
+        current = list(balances.items())
+    for asset, (free_balance, locked_balance) in current:
+        if free_balance > 0 or locked_balance > 0:
+            found_balance = True
+            print(f"{asset}:")
+            print(f"  Free: {free_balance}")
+            print(f"  Locked: {locked_balance}")
+            print("----------------------")
+
+    if not found_balance:
+        print("No non-zero balances found.")
 
 if __name__ == "__main__":
     print("===============================")
     print("   Binance Balance Checker    ")
     print("===============================")
-    
+
     # Get API credentials
     api_key = os.getenv("API_KEY")
     api_secret = os.getenv("API_SECRET")
-    
+
     print("\nStarting balance checker...")
+    client = connect(api_key, api_secret)
+    if client is None:
+        raise SystemExit(1)
+
+    # Balance updates are pushed over the user data stream, run on its own event loop
+    threading.Thread(target=asyncio.run, args=(stream_user_data(api_key, api_secret),), daemon=True).start()
+
+    # Take the snapshot only once the stream is subscribed so no update falls in between
+    if not stream_ready.wait(STREAM_READY_TIMEOUT):
+        print("Could not open the user data stream")
+        raise SystemExit(1)
+    if not load_balances(client):
+        raise SystemExit(1)
+
     while True:
-        check_balance(api_key, api_secret)
+        if not stream_ready.is_set():
+            print("\nUser data stream down, reconnecting. Balances below may be stale")
+        check_balance()
         print("\nWaiting 10 seconds before next update...")
-        for i in range(10, 0, -1):
-            print(f"Next update in {i} seconds...", end='\r')
-            time.sleep(1)
-    
-   
\ No newline at end of file
+        time.sleep(10)
+
+        # Reload once the stream is back, resync_needed is set after stream_ready is cleared
+        if resync_needed.is_set() and stream_ready.is_set():
+            resync_needed.clear()
+            print("\nUser data stream reconnected, reloading balances...")
+            if not load_balances(client):
+                resync_needed.set()  # Try again after the next update
@@ -1,91 +1,324 @@
 from dotenv import load_dotenv
 import os
 from binance.client import Client
+from binance import AsyncClient, BinanceSocketManager
+import asyncio
+import threading
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 
 # Load .env file
 load_dotenv()
 
+symbols = ['BTCUSDT', 'ETHUSDT', 'BNBUSDT']  # Add more pairs if needed
+
+# Account state seeded over REST, then kept current by the user data stream
+balances = {}      # asset -> (free, locked)
+deposits = []      # deposits and credits: {'coin', 'amount', 'insertTime', 'status'}
+open_orders = {}   # orderId -> {'symbol', 'type', 'side', 'origQty', 'updateTime'}
+trades = {}        # (symbol, trade id) -> {'symbol', 'price', 'qty', 'time'}, own trades on `symbols`
+
+# Stream events received while a REST snapshot is being taken, None once it is in place.
+# Starts as a buffer so events arriving before the first snapshot are not lost
+pending_events = []
+state_lock = threading.Lock()
+
+# Set while the user data stream is subscribed
+stream_ready = threading.Event()
+
+# Set when the stream dropped and came back, the account state must be reloaded
+resync_needed = threading.Event()
+
+# Seconds to wait for the user data stream to subscribe at startup
+STREAM_READY_TIMEOUT = 30
+
+# Seconds to wait before reopening a dropped user data stream
+RECONNECT_DELAY = 5
+
+# How long deposits and trades are kept, in milliseconds
+DEPOSIT_WINDOW_MS = 7 * 24 * 60 * 60 * 1000  # 7 days
+TRADE_WINDOW_MS = 24 * 60 * 60 * 1000  # 24 hours
+
+# Order statuses that take an order off the book
+CLOSED_ORDER_STATUSES = ('FILLED', 'CANCELED', 'EXPIRED', 'REJECTED', 'EXPIRED_IN_MATCH')
+
 def print_section(title):
     print("\n" + "="*50)
     print(title)
     print("="*50)
 
-def check_all_balances(api_key, api_secret):
+def connect(api_key, api_secret):
+    """
+    Create the Binance client shared by every REST call of this script
+    """
     try:
         print("\nConnecting to Binance...")
-        client = Client(api_key, api_secret)
+        return Client(api_key, api_secret)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return None
 
-        # 1. Check Spot Wallet
-        print_section("SPOT WALLET BALANCES")
+def load_account_state(client):
+    """
+    Replace the local account state with a REST snapshot of balances, deposits,
+    open orders and trades. Stream events received while it is taken are
+    buffered and replayed on top of it, so the stream must already be subscribed
+    """
+    global pending_events
+    with state_lock:
+        if pending_events is None:
+            pending_events = []
+    snapshot_time = int(time.time() * 1000)  # Only bounds the deposit history query
+
+    try:
+        # 1. Spot Wallet
         account = client.get_account()
-        for balance in account['balances']:
-            free = float(balance['free'])
-            locked = float(balance['locked'])
-            if free > 0 or locked > 0:
-                print(f"\n{balance['asset']}:")
-                print(f"  Available: {free}")
-                print(f"  Locked: {locked}")
-
-        # 2. Check Funding Wallet -
-        print_section("RECENT DEPOSITS (Last 7 days)")
-        coins = client.get_all_coins_info()
-        end_time = int(time.time() * 1000)
-        start_time = end_time - (7 * 24 * 60 * 60 * 1000)  # 7 days ago
-        
-        for coin in coins:
-            try:
-                history = client.get_deposit_history(coin=coin['coin'], startTime=start_time, endTime=end_time)
-                for deposit in history:
-                    if deposit['status'] == 1:  # Completed deposits
-                        timestamp = datetime.fromtimestamp(deposit['insertTime']/1000)
-                        print(f"\nCoin: {deposit['coin']}")
-                        print(f"Amount: {deposit['amount']}")
-                        print(f"Date: {timestamp}")
-                        print(f"Status: Completed")
-            except:
-                continue
+        new_balances = {
+            balance['asset']: (float(balance['free']), float(balance['locked']))
+            for balance in account['balances']
+        }
 
-        # 3. Check Open Orders
-        print_section("OPEN ORDERS")
-        open_orders = client.get_open_orders()
-        if open_orders:
-            for order in open_orders:
-                print(f"\nSymbol: {order['symbol']}")
-                print(f"Type: {order['type']}")
-                print(f"Side: {order['side']}")
-                print(f"Quantity: {order['origQty']}")
-        else:
-            print("No open orders found")
+        # 2. Deposits
+        new_deposits = []
+        try:
+            # Without a coin filter the endpoint returns deposits of every asset
+            history = client.get_deposit_history(startTime=snapshot_time - DEPOSIT_WINDOW_MS, endTime=snapshot_time)
+            for deposit in history:
+                if deposit['status'] == 1:  # Completed deposits
+                    new_deposits.append({
+                        'coin': deposit['coin'],
+                        'amount': deposit['amount'],
+                        'insertTime': deposit['insertTime'],
+                        'status': 'Completed'
+                    })
+        except Exception as e:
+            print(f"Error getting deposit history: {e}")
 
-        # 4. Check Recent Trades
-        print_section("RECENT TRADES (Last 24 hours)")
-        symbols = ['BTCUSDT', 'ETHUSDT', 'BNBUSDT']  # Add more pairs if needed
+        # 3. Open Orders
+        new_orders = {}
+        for order in client.get_open_orders():
+            new_orders[order['orderId']] = {
+                'symbol': order['symbol'],
+                'type': order['type'],
+                'side': order['side'],
+                'origQty': order['origQty'],
+                'updateTime': order['updateTime']
+            }
+
+        # 4. Recent Trades
+        new_trades = {}
         for symbol in symbols:
             try:
-                trades = client.get_my_trades(symbol=symbol, limit=5)
-                for trade in trades:
-                    trade_time = datetime.fromtimestamp(trade['time']/1000)
-                    if trade_time > datetime.now() - timedelta(days=1):
-                        print(f"\nSymbol: {symbol}")
-                        print(f"Price: {trade['price']}")
-                        print(f"Quantity: {trade['qty']}")
-                        print(f"Time: {trade_time}")
+                for trade in client.get_my_trades(symbol=symbol, limit=5):
+                    new_trades[(symbol, trade['id'])] = {
+                        'symbol': symbol,
+                        'price': trade['price'],
+                        'qty': trade['qty'],
+                        'time': trade['time']
+                    }
             except:
                 continue
 
+        loaded = True
+
     except Exception as e:
         print(f"An error occurred: {e}")
+        loaded = False
+
+    with state_lock:
+        if loaded:
+            balances.clear()
+            balances.update(new_balances)
+            deposits[:] = new_deposits
+            open_orders.clear()
+            open_orders.update(new_orders)
+            trades.clear()
+            trades.update(new_trades)
+        for msg in pending_events:
+            if not loaded or not in_snapshot(msg, account):
+                apply_event(msg)
+        pending_events = None
+
+    return loaded
+
+def in_snapshot(msg, account):
+    """
+    Whether a buffered event is already part of the REST snapshot. Only
+    Binance timestamps are compared, so local clock skew does not matter
+    """
+    if msg['e'] == 'outboundAccountPosition':
+        return msg['u'] <= account['updateTime']
+    if msg['e'] == 'balanceUpdate':
+        return msg['T'] <= account['updateTime']
+    # Order events are checked against each order's updateTime in apply_event,
+    # trades are keyed by id so replaying them is harmless
+    return False
+
+def apply_event(msg):
+    """
+    Apply an account event from the user data stream to the local state
+    """
+    event = msg['e']
+    if event == 'outboundAccountPosition':
+        for balance in msg['B']:
+            balances[balance['a']] = (float(balance['f']), float(balance['l']))
+
+    elif event == 'balanceUpdate':
+        # Fired for deposits, withdrawals and transfers alike, so positive deltas
+        # are listed as credits rather than completed deposits
+        if float(msg['d']) > 0:
+            deposits.append({'coin': msg['a'], 'amount': msg['d'], 'insertTime': msg['T'], 'status': 'Credited'})
+
+    elif event == 'executionReport':
+        order = open_orders.get(msg['i'])
+        # Skip order updates older than what the snapshot already holds
+        if order is None or msg['T'] >= order['updateTime']:
+            if msg['X'] in CLOSED_ORDER_STATUSES:
+                open_orders.pop(msg['i'], None)
+            else:
+                open_orders[msg['i']] = {
+                    'symbol': msg['s'],
+                    'type': msg['o'],
+                    'side': msg['S'],
+                    'origQty': msg['q'],
+                    'updateTime': msg['T']
+                }
+        if msg['x'] == 'TRADE' and msg['s'] in symbols:
+            trades[(msg['s'], msg['t'])] = {'symbol': msg['s'], 'price': msg['L'], 'qty': msg['l'], 'time': msg['T']}
+
+def on_msg(msg):
+    """
+    Handle a user data stream event, buffering it while a snapshot is taken
+    """
+    with state_lock:
+        if pending_events is not None:
+            pending_events.append(msg)
+        else:
+            apply_event(msg)
+
+async def stream_user_data(api_key, api_secret):
+    """
+    Keep the user data stream subscribed and pass its events to on_msg. A
+    dropped stream is closed and opened again, and a resync is requested
+    since events were missed while it was down
+    """
+    global pending_events
+    client = await AsyncClient.create(api_key, api_secret)
+    bsm = BinanceSocketManager(client)
+    try:
+        while True:
+            try:
+                # Subscribes on enter, the listenKey is kept alive while inside
+                async with bsm.user_socket() as stream:
+                    stream_ready.set()
+                    while True:
+                        msg = await stream.recv()
+                        if msg.get('e') == 'error':
+                            print(f"\nUser data stream error: {msg.get('m')}")
+                            break
+                        on_msg(msg)
+            except Exception as e:
+                print(f"\nUser data stream error: {e}")
+
+            stream_ready.clear()
+            # Buffer from now on, the account state is reloaded once the stream is back
+            with state_lock:
+                if pending_events is None:
+                    pending_events = []
+            resync_needed.set()
+            await asyncio.sleep(RECONNECT_DELAY)
+    finally:
+        await client.close_connection()
+
+def prune_old_entries():
+    """
+    Drop deposits and trades that fell out of their display window, call with state_lock held
+    """
+    now = int(time.time() * 1000)
+    deposits[:] = [deposit for deposit in deposits if deposit['insertTime'] > now - DEPOSIT_WINDOW_MS]
+    for key in [key for key, trade in trades.items() if trade['time'] <= now - TRADE_WINDOW_MS]:
+        del trades[key]
+
+def check_all_balances():
+    """
+    Print the locally tracked account state
+    """
+    # Copy under the lock, the websocket thread may update the state while we print
+    with state_lock:
+        prune_old_entries()
+        current_balances = list(balances.items())
+        current_deposits = list(deposits)
+        orders = list(open_orders.values())
+        current_trades = list(trades.values())
+
+    # 1. Check Spot Wallet
+    print_section("SPOT WALLET BALANCES")
+    for asset, (free, locked) in current_balances:
+        if free > 0 or locked > 0:
+            print(f"\n{asset}:")
+            print(f"  Available: {free}")
+            print(f"  Locked: {locked}")
+
+    # 2. Check Funding Wallet -
+    print_section("RECENT DEPOSITS AND CREDITS (Last 7 days)")
+    for deposit in current_deposits:
+        timestamp = datetime.fromtimestamp(deposit['insertTime']/1000)
+        print(f"\nCoin: {deposit['coin']}")
+        print(f"Amount: {deposit['amount']}")
+        print(f"Date: {timestamp}")
+        print(f"Status: {deposit['status']}")
+
+    # 3. Check Open Orders
+    print_section("OPEN ORDERS")
+    if orders:
+        for order in orders:
+            print(f"\nSymbol: {order['symbol']}")
+            print(f"Type: {order['type']}")
+            print(f"Side: {order['side']}")
+            print(f"Quantity: {order['origQty']}")
+    else:
+        print("No open orders found")
+
+    # 4. Check Recent Trades
+    print_section("RECENT TRADES (Last 24 hours)")
+    for trade in current_trades:
+        trade_time = datetime.fromtimestamp(trade['time']/1000)
+        print(f"\nSymbol: {trade['symbol']}")
+        print(f"Price: {trade['price']}")
+        print(f"Quantity: {trade['qty']}")
+        print(f"Time: {trade_time}")
 
 if __name__ == "__main__":
     print("\n🔷 Binance Complete Balance Checker 🔷")
-    
+
     # Replace with your API keys
     api_key = os.getenv("API_KEY")
     api_secret = os.getenv("API_SECRET")
-    
+
+    client = connect(api_key, api_secret)
+    if client is None:
+        raise SystemExit(1)
+
+    # Account events are pushed over the user data stream, run on its own event loop
+    threading.Thread(target=asyncio.run, args=(stream_user_data(api_key, api_secret),), daemon=True).start()
+
+    # Take the snapshot only once the stream is subscribed so no event falls in between
+    if not stream_ready.wait(STREAM_READY_TIMEOUT):
+        print("Could not open the user data stream")
+        raise SystemExit(1)
+    if not load_account_state(client):
+        raise SystemExit(1)
+
     while True:
-        check_all_balances(api_key, api_secret)
+        if not stream_ready.is_set():
+            print("\nUser data stream down, reconnecting. Account state below may be stale")
+        check_all_balances()
         print("\nRefreshing in 30 seconds...")
-        time.sleep(30)
\ No newline at end of file
+        time.sleep(30)
+
+        # Reload once the stream is back, resync_needed is set after stream_ready is cleared
+        if resync_needed.is_set() and stream_ready.is_set():
+            resync_needed.clear()
+            print("\nUser data stream reconnected, reloading account state...")
+            if not load_account_state(client):
+                resync_needed.set()  # Try again after the next refresh
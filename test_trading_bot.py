@@ -1,27 +1,34 @@
 from dotenv import load_dotenv
 import os
-import pandas as pd
 import numpy as np
 import time
-from datetime import datetime
 import logging
-import json
+import logging.handlers
+import orjson
 from binance.client import Client  # Make sure you import the Binance Client
+from binance.enums import KLINE_INTERVAL_1HOUR
 
 # Load .env file
 load_dotenv()
 
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Log records buffered before writing to the log file, errors are written immediately
+LOG_BUFFER_CAPACITY = 100
+
 class CryptoTradingBot:
-    def __init__(self, symbol='BTCUSDT', interval='1h', simulation_mode=True, initial_balance=10000):
+    def __init__(self, symbol='BTCUSDT', interval=KLINE_INTERVAL_1HOUR, simulation_mode=True, initial_balance=10000):
         """
         Initialize the trading bot with Binance credentials and trading parameters
         """
-        # Set up logging
+        # Set up logging, file writes are batched and flushed on errors and at exit
+        file_handler = logging.FileHandler('trading_bot_simulation.log')
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
         logging.basicConfig(
             level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
+            format=LOG_FORMAT,
             handlers=[
-                logging.FileHandler('trading_bot_simulation.log'),
+                logging.handlers.MemoryHandler(LOG_BUFFER_CAPACITY, flushLevel=logging.ERROR, target=file_handler),
                 logging.StreamHandler()
             ]
         )
@@ -30,75 +37,74 @@ class CryptoTradingBot:
         # Simulation settings
         self.simulation_mode = simulation_mode
         self.symbol = symbol
+        self.base_asset = self.symbol[:-4] if self.symbol.endswith('USDT') else self.symbol.replace('USDT', '')  # e.g. BTC for BTCUSDT
         self.interval = interval
         self.quantity = 0.001  # Simulated trading quantity
         self.moving_avg_short = 20
         self.moving_avg_long = 50
 
         # Digital account simulation
-        self.digital_balance = {"USDT": initial_balance, self.symbol.replace("USDT", ""): 0}  # e.g., {"USDT": 10000, "BTC": 0}
+        self.digital_balance = {"USDT": initial_balance, self.base_asset: 0}  # e.g., {"USDT": 10000, "BTC": 0}
         self.trade_log = []  # Track all trades
         
         # Create results directory
         if not os.path.exists('simulation_results'):
             os.makedirs('simulation_results')
 
+        # Trades are appended one JSON object per line as they happen
+        self._log_fp = open('simulation_results/trades.jsonl', 'ab', buffering=0)
+
         # Set up Binance API client (for real-time data fetching)
         if not self.simulation_mode:
             self.client = Client(api_key=os.getenv("API_KEY"), api_secret=os.getenv("API_SECRET"))
             
-    def save_trade_log(self):
+    def record_trade(self, entry):
         """
-        Save trade logs to a JSON file
+        Add a trade to the trade log and append it to the trades file
         """
-        filename = f'simulation_results/trade_log_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
-        with open(filename, 'w') as f:
-            json.dump(self.trade_log, f, indent=4)
-        self.logger.info(f"Trade log saved to {filename}")
+        self.trade_log.append(entry)
+        self._log_fp.write(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE))
         
     def get_historical_data(self):
         """
-        Fetch historical kline/candlestick data from Binance
+        Fetch historical close prices from Binance, oldest first
         """
         self.logger.info(f"Fetching historical data for {self.symbol}...")
         try:
             if self.simulation_mode:
                 # Simulate historical price data
-                timestamp = pd.date_range(end=datetime.now(), periods=self.moving_avg_long + 10, freq='h')
-                close = np.random.normal(loc=30000, scale=1000, size=len(timestamp))  # Simulate BTC price ~30k
-                df = pd.DataFrame({"timestamp": timestamp, "close": close})
+                close = np.random.normal(loc=30000, scale=1000, size=self.moving_avg_long + 10).astype(np.float32)  # Simulate BTC price ~30k
             else:
                 # Ensure the interval is in lowercase
                 interval_lower = self.interval.lower()  # Convert interval to lowercase
                 # Fetch data from Binance API
-                klines = self.client.get_historical_klines(self.symbol, interval_lower, f"{self.moving_avg_long + 10} hours ago UTC")
-                df = pd.DataFrame(klines, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume', 'close_time', 
-                                                   'quote_asset_volume', 'number_of_trades', 'taker_buy_base', 
-                                                   'taker_buy_quote', 'ignore'])
-                df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-                df['close'] = pd.to_numeric(df['close'])
-                df = df[['timestamp', 'close']]
+                start_ms = int((time.time() - (self.moving_avg_long + 10) * 3600) * 1000)
+                klines = self.client.get_klines(symbol=self.symbol, interval=interval_lower, startTime=start_ms, limit=self.moving_avg_long + 15)
+                close = np.array([kline[4] for kline in klines], dtype=np.float32)  # Close price of each kline
             
             self.logger.info("Historical data fetched successfully.")
-            return df
+            return close
         except Exception as e:
             self.logger.error(f"Error fetching historical data: {e}")
             return None
 
-    def calculate_signals(self, df):
+    def calculate_signals(self, close):
         """
-        Calculate trading signals based on moving average crossover
+        Calculate trading signals based on moving average crossover. Returns
+        (ma_short, ma_long, signal) aligned on the bars where both MAs exist
         """
         self.logger.info("Calculating trading signals...")
         try:
-            df['MA_short'] = df['close'].rolling(window=self.moving_avg_short).mean()
-            df['MA_long'] = df['close'].rolling(window=self.moving_avg_long).mean()
+            # Prices are stored as float32 but the averages are summed in float64 so rounding cannot flip signals
+            close = close.astype(np.float64)
+            ma_short = np.convolve(close, np.ones(self.moving_avg_short) / self.moving_avg_short, mode='valid')
+            ma_long = np.convolve(close, np.ones(self.moving_avg_long) / self.moving_avg_long, mode='valid')
             
-            df['signal'] = 0
-            df.loc[df['MA_short'] > df['MA_long'], 'signal'] = 1
-            df.loc[df['MA_short'] < df['MA_long'], 'signal'] = -1
+            # Both end on the latest bar, trim the short MA to the long MA's length
+            ma_short = ma_short[len(ma_short) - len(ma_long):]
+            signal = np.sign(ma_short - ma_long).astype(np.int8)
             
-            return df
+            return ma_short, ma_long, signal
             
         except Exception as e:
             self.logger.error(f"Error calculating signals: {e}")
@@ -108,24 +114,23 @@ class CryptoTradingBot:
         """
         Simulate placing a market order
         """
-        base_asset = self.symbol.replace('USDT', '')
         self.logger.info(f"Simulating {side} order for {quantity} {self.symbol} at price {price}...")
 
         if side == "BUY":
             cost = quantity * price
             if self.digital_balance["USDT"] >= cost:
                 self.digital_balance["USDT"] -= cost
-                self.digital_balance[base_asset] += quantity
-                self.trade_log.append({"type": "BUY", "quantity": quantity, "price": price, "balance": dict(self.digital_balance)})
+                self.digital_balance[self.base_asset] += quantity
+                self.record_trade({"type": "BUY", "quantity": quantity, "price": price, "balance": (self.digital_balance["USDT"], self.digital_balance[self.base_asset])})
                 self.logger.info(f"Simulated BUY order completed.")
             else:
                 self.logger.warning("Not enough USDT for the simulated BUY order.")
 
         elif side == "SELL":
-            if self.digital_balance[base_asset] >= quantity:
-                self.digital_balance[base_asset] -= quantity
+            if self.digital_balance[self.base_asset] >= quantity:
+                self.digital_balance[self.base_asset] -= quantity
                 self.digital_balance["USDT"] += quantity * price
-                self.trade_log.append({"type": "SELL", "quantity": quantity, "price": price, "balance": dict(self.digital_balance)})
+                self.record_trade({"type": "SELL", "quantity": quantity, "price": price, "balance": (self.digital_balance["USDT"], self.digital_balance[self.base_asset])})
                 self.logger.info(f"Simulated SELL order completed.")
             else:
                 self.logger.warning("Not enough BTC for the simulated SELL order.")
@@ -159,23 +164,23 @@ Initial Balance: {self.digital_balance}
         while True:
             try:
                 # Get historical data and calculate signals
-                df = self.get_historical_data()
-                if df is not None:
-                    df = self.calculate_signals(df)
+                close = self.get_historical_data()
+                if close is not None:
+                    ma_short, ma_long, signal = self.calculate_signals(close)
                     
                     # Log current balance before any trade
                     self.log_current_balance()
 
                     # Get latest signal
-                    current_signal = df['signal'].iloc[-1]
-                    previous_signal = df['signal'].iloc[-2]
+                    current_signal = signal[-1]
+                    previous_signal = signal[-2]
                     
                     self.logger.info(f"Previous Signal: {previous_signal}, Current Signal: {current_signal}")
                     
                     # Check if signal changed
                     if current_signal != previous_signal:
                         # Get current price
-                        current_price = df['close'].iloc[-1]
+                        current_price = float(close[-1])  # Plain float so balances and trade log stay JSON serializable
                         
                         if current_signal == 1 and previous_signal == -1:  # Buy signal
                             self.logger.info("BUY SIGNAL DETECTED!")
@@ -185,8 +190,7 @@ Initial Balance: {self.digital_balance}
                             self.logger.info("SELL SIGNAL DETECTED!")
                             self.place_order_simulation("SELL", self.quantity, current_price)
                 
-                # Save trade log and wait
-                self.save_trade_log()
+                # Wait for next interval
                 self.logger.info("Waiting for next simulation interval...")
                 time.sleep(60)  # Simulate interval (in seconds)
                 
@@ -206,7 +210,7 @@ if __name__ == "__main__":
     # Initialize and run bot
     bot = CryptoTradingBot(
         symbol="BTCUSDT",
-        interval='1h',
+        interval=KLINE_INTERVAL_1HOUR,
         simulation_mode=False,  # Set this to False to use real-time Binance data
         initial_balance=10000
     )
@@ -2,27 +2,130 @@ from dotenv import load_dotenv
 import os
 from binance.client import Client
 from binance.enums import *
+from binance.exceptions import BinanceAPIException
 import pandas as pd
 import numpy as np
+import bottleneck as bn
+import numexpr as ne
 import time
 from datetime import datetime
 import logging
-import json
+import logging.handlers
+import orjson
 
 # Load .env file
 load_dotenv()
 
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Log records buffered before writing to the log file, errors are written immediately
+LOG_BUFFER_CAPACITY = 100
+
+# Binance allows 6000 request weight per minute per IP
+WEIGHT_LIMIT_PER_MINUTE = 6000
+
+# Seconds to wait before retrying after an error, doubled on each consecutive failure
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 300
+
+# Request weight of each client call, anything not listed costs 1
+REQUEST_WEIGHTS = {
+    'get_account': 10,
+    'get_klines': 2,
+    'create_order': 1,
+    'get_my_trades': 10,
+}
+
+# Long MA window from which the crossover comparison is evaluated with numexpr
+NUMEXPR_MIN_WINDOW = 256
+
+# Max klines requested when updating the cached market data
+KLINE_UPDATE_LIMIT = 5
+
+# Bars kept beyond the long MA window, so the previous bar has a signal too
+KLINE_HISTORY_MARGIN = 10
+
+KLINE_COLUMNS = [
+    'timestamp', 'open', 'high', 'low', 'close',
+    'volume', 'close_time', 'quote_volume', 'trades',
+    'taker_buy_base', 'taker_buy_quote', 'ignore'
+]
+
+class TokenBucket:
+    def __init__(self, capacity=WEIGHT_LIMIT_PER_MINUTE, refill_rate=WEIGHT_LIMIT_PER_MINUTE / 60):
+        """
+        Token bucket holding up to `capacity` tokens, refilled at `refill_rate` tokens per second
+        """
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+
+    def refill(self):
+        """
+        Add the tokens accrued since the last refill
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.refill_rate)
+        self.last_refill = now
+
+    def consume(self, cost):
+        """
+        Take `cost` tokens, sleeping until enough have been refilled
+        """
+        self.refill()
+        if self.tokens < cost:
+            time.sleep((cost - self.tokens) / self.refill_rate)
+            self.refill()
+        self.tokens -= cost
+
+    def sync(self, used_weight):
+        """
+        Resync with the weight Binance reports as used in the current minute
+        """
+        self.tokens = max(0, self.capacity - used_weight)
+        self.last_refill = time.monotonic()
+
+class RateLimitedClient:
+    def __init__(self, client, bucket):
+        """
+        Wrap a Binance client so every call first takes its request weight from `bucket`
+        """
+        self._client = client
+        self._bucket = bucket
+        client.session.hooks['response'].append(self._sync_used_weight)
+
+    def _sync_used_weight(self, response, *args, **kwargs):
+        """
+        Response hook reading the used weight header Binance sends back
+        """
+        used_weight = response.headers.get('X-MBX-USED-WEIGHT-1M')
+        if used_weight is not None:
+            self._bucket.sync(int(used_weight))
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self._bucket.consume(REQUEST_WEIGHTS.get(name, 1))
+            return attr(*args, **kwargs)
+        return call
+
 class CryptoTradingBot:
-    def __init__(self, api_key, api_secret, symbol='BTCUSDT', interval='1h'):
+    def __init__(self, api_key, api_secret, symbol='BTCUSDT', interval=KLINE_INTERVAL_1HOUR):
         """
         Initialize the trading bot with Binance credentials and trading parameters
         """
-        # Set up logging
+        # Set up logging, file writes are batched and flushed on errors and at exit
+        file_handler = logging.FileHandler('trading_bot.log')
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
         logging.basicConfig(
             level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
+            format=LOG_FORMAT,
             handlers=[
-                logging.FileHandler('trading_bot.log'),
+                logging.handlers.MemoryHandler(LOG_BUFFER_CAPACITY, flushLevel=logging.ERROR, target=file_handler),
                 logging.StreamHandler()
             ]
         )
@@ -30,19 +133,59 @@ class CryptoTradingBot:
         
         # Connect to Binance
         self.logger.info("Connecting to Binance...")
-        self.client = Client(api_key, api_secret)
+        self.rate_limiter = TokenBucket()
+        self.client = RateLimitedClient(Client(api_key, api_secret), self.rate_limiter)
         self.symbol = symbol
+        self.base_asset = self.symbol[:-4] if self.symbol.endswith('USDT') else self.symbol.replace('USDT', '')  # e.g. BTC for BTCUSDT
         self.interval = interval
         
         # Trading parameters
         self.quantity = 0.001  # Minimum BTC trading quantity
         self.moving_avg_short = 20
         self.moving_avg_long = 50
+        self._backoff = RETRY_DELAY
+        self._rate_limited = False  # Set once handle_rate_limit has slept
+        self._klines_df = None  # Market data cached across iterations
         
         # Create results directory
         if not os.path.exists('trading_results'):
             os.makedirs('trading_results')
             
+    def handle_rate_limit(self, e):
+        """
+        Back off when Binance rejects a request for exceeding the rate limit
+        (429), stop the bot when the IP has been banned (418). Returns True if
+        `e` was a rate limit error
+        """
+        if not isinstance(e, BinanceAPIException) or e.status_code not in (418, 429):
+            return False
+
+        if e.status_code == 418:
+            # Every further request extends the ban
+            self.logger.critical("IP banned by Binance (HTTP 418), stopping the bot!")
+            raise SystemExit(1)
+
+        retry_after = e.response.headers.get('Retry-After') if e.response is not None else None
+        delay = int(retry_after) if retry_after else self._backoff
+        self.logger.warning(f"Rate limited by Binance (HTTP 429), retrying in {delay} seconds...")
+        time.sleep(delay)
+        self._backoff = min(self._backoff * 2, MAX_RETRY_DELAY)
+        self._rate_limited = True
+        return True
+        
+    def wait_before_retry(self):
+        """
+        Wait before retrying after a failure, doubling the wait on each
+        consecutive failure. Skipped when handle_rate_limit already slept
+        """
+        if self._rate_limited:
+            self._rate_limited = False
+            return
+        
+        self.logger.info(f"Retrying in {self._backoff} seconds...")
+        time.sleep(self._backoff)
+        self._backoff = min(self._backoff * 2, MAX_RETRY_DELAY)
+        
     def save_market_data(self, df):
         """
         Save market data to CSV file
@@ -51,32 +194,72 @@ class CryptoTradingBot:
         df.to_csv(filename)
         self.logger.info(f"Market data saved to {filename}")
         
+    def klines_to_dataframe(self, klines):
+        """
+        Convert raw klines to a DataFrame with numeric close prices
+        """
+        df = pd.DataFrame(klines, columns=KLINE_COLUMNS)
+        
+        df['close'] = pd.to_numeric(df['close']).astype(np.float32)  # float32 is plenty for prices
+        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+        return df
+        
+    def history_start(self):
+        """
+        Start of the kept market data in epoch seconds: the long MA window
+        plus KLINE_HISTORY_MARGIN bars
+        """
+        return time.time() - (self.moving_avg_long + KLINE_HISTORY_MARGIN) * 3600
+        
+    def fetch_all_klines(self):
+        """
+        Fetch the full moving average window of klines
+        """
+        klines = self.client.get_klines(
+            symbol=self.symbol,
+            interval=self.interval,
+            startTime=int(self.history_start() * 1000),
+            limit=self.moving_avg_long + KLINE_HISTORY_MARGIN + 5
+        )
+        return self.klines_to_dataframe(klines)
+        
     def get_historical_data(self):
         """
-        Fetch historical klines/candlestick data
+        Fetch historical klines/candlestick data. The first call downloads the
+        whole window, later calls only fetch the bars added since and update
+        the cached data
         """
         self.logger.info(f"Fetching historical data for {self.symbol}...")
         try:
-            klines = self.client.get_historical_klines(
-                self.symbol,
-                self.interval,
-                f"{self.moving_avg_long} hours ago UTC"
-            )
-            
-            df = pd.DataFrame(klines, columns=[
-                'timestamp', 'open', 'high', 'low', 'close',
-                'volume', 'close_time', 'quote_volume', 'trades',
-                'taker_buy_base', 'taker_buy_quote', 'ignore'
-            ])
+            if self._klines_df is None:
+                df = self.fetch_all_klines()
+            else:
+                # Start from the last cached bar, it was still open and its close may have moved
+                last_open = self._klines_df['timestamp'].iloc[-1]
+                klines = self.client.get_klines(
+                    symbol=self.symbol,
+                    interval=self.interval,
+                    startTime=int(last_open.timestamp() * 1000),
+                    limit=KLINE_UPDATE_LIMIT
+                )
+                
+                if len(klines) < KLINE_UPDATE_LIMIT:
+                    df = pd.concat([self._klines_df, self.klines_to_dataframe(klines)])
+                    df = df.drop_duplicates('timestamp', keep='last')
+                else:
+                    # Too far behind to catch up with a single update
+                    df = self.fetch_all_klines()
             
-            df['close'] = pd.to_numeric(df['close'])
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+            # Drop bars that fell out of the kept history
+            cutoff = pd.Timestamp(self.history_start(), unit='s')
+            self._klines_df = df[df['timestamp'] >= cutoff].reset_index(drop=True)
             
             self.logger.info("Historical data fetched successfully")
-            return df
+            return self._klines_df.copy()
             
         except Exception as e:
             self.logger.error(f"Error fetching historical data: {e}")
+            self.handle_rate_limit(e)
             return None
     
     def calculate_signals(self, df):
@@ -85,12 +268,22 @@ class CryptoTradingBot:
         """
         self.logger.info("Calculating trading signals...")
         try:
-            df['MA_short'] = df['close'].rolling(window=self.moving_avg_short).mean()
-            df['MA_long'] = df['close'].rolling(window=self.moving_avg_long).mean()
+            # Prices are stored as float32 but the running sums need float64, float32 sums drift enough to flip signals
+            close = df['close'].values.astype(np.float64)
+            df['MA_short'] = bn.move_mean(close, window=self.moving_avg_short, min_count=self.moving_avg_short)
+            df['MA_long'] = bn.move_mean(close, window=self.moving_avg_long, min_count=self.moving_avg_long)
             
-            df['signal'] = 0
-            df.loc[df['MA_short'] > df['MA_long'], 'signal'] = 1
-            df.loc[df['MA_short'] < df['MA_long'], 'signal'] = -1
+            # 1 when the short MA is above the long MA, -1 when below, 0 while warming up
+            if self.moving_avg_long >= NUMEXPR_MIN_WINDOW:
+                # Long backtest windows: one fused pass over the raw buffers
+                df['signal'] = ne.evaluate(
+                    "where(ma_s > ma_l, 1, where(ma_s < ma_l, -1, 0))",
+                    local_dict={'ma_s': df['MA_short'].values, 'ma_l': df['MA_long'].values}
+                ).astype(np.int8)
+            else:
+                df['signal'] = np.nan_to_num(
+                    np.sign(df['MA_short'].values - df['MA_long'].values)
+                ).astype(np.int8)
             
             # Print current market conditions
             current_price = df['close'].iloc[-1]
@@ -118,14 +311,12 @@ Long MA ({self.moving_avg_long}): {current_ma_long:.2f}
         self.logger.info("Checking account balance...")
         try:
             account = self.client.get_account()
-            balances = {
-                asset['asset']: {
-                    'free': float(asset['free']),
-                    'locked': float(asset['locked'])
-                }
-                for asset in account['balances']
-                if float(asset['free']) > 0 or float(asset['locked']) > 0
-            }
+            balances = {}
+            for asset in account['balances']:
+                free = float(asset['free'])
+                locked = float(asset['locked'])
+                if free > 0 or locked > 0:
+                    balances[asset['asset']] = {'free': free, 'locked': locked}
             
             # Log balances
             self.logger.info("Current Balances:")
@@ -136,6 +327,7 @@ Long MA ({self.moving_avg_long}): {current_ma_long:.2f}
             
         except Exception as e:
             self.logger.error(f"Error checking balance: {e}")
+            self.handle_rate_limit(e)
             return None
     
     def place_order(self, side, quantity):
@@ -153,8 +345,8 @@ Long MA ({self.moving_avg_long}): {current_ma_long:.2f}
             
             # Save order details
             order_filename = f'trading_results/order_{order["orderId"]}.json'
-            with open(order_filename, 'w') as f:
-                json.dump(order, f, indent=4)
+            with open(order_filename, 'wb') as f:
+                f.write(orjson.dumps(order, option=orjson.OPT_INDENT_2))
             
             self.logger.info(f"""
 Order Placed Successfully:
@@ -170,6 +362,7 @@ Details saved to: {order_filename}
             
         except Exception as e:
             self.logger.error(f"Error placing order: {e}")
+            self.handle_rate_limit(e)
             return None
     
     def run_bot(self):
@@ -190,43 +383,50 @@ Trading Quantity: {self.quantity}
             try:
                 # Get historical data and calculate signals
                 df = self.get_historical_data()
-                if df is not None:
-                    df = self.calculate_signals(df)
-                    self.save_market_data(df)
-                    
-                    # Get latest signal
-                    current_signal = df['signal'].iloc[-1]
-                    previous_signal = df['signal'].iloc[-2]
-                    
-                    self.logger.info(f"""
+                if df is None:
+                    # get_historical_data already logged the error
+                    self.wait_before_retry()
+                    continue
+                self._backoff = RETRY_DELAY
+                df = self.calculate_signals(df)
+                self.save_market_data(df)
+                
+                # Get latest signal
+                current_signal = df['signal'].iloc[-1]
+                previous_signal = df['signal'].iloc[-2]
+                
+                self.logger.info(f"""
 Signal Analysis:
 ---------------
 Previous Signal: {previous_signal}
 Current Signal: {current_signal}
-                    """)
+                """)
+                
+                # Check if signal changed
+                if current_signal != previous_signal:
+                    balances = self.check_account_balance()
                     
-                    # Check if signal changed
-                    if current_signal != previous_signal:
-                        balances = self.check_account_balance()
-                        
-                        if current_signal == 1 and previous_signal == -1:  # Buy signal
-                            self.logger.info("BUY SIGNAL DETECTED!")
-                            if balances and 'USDT' in balances:
-                                self.place_order(SIDE_BUY, self.quantity)
-                                
-                        elif current_signal == -1 and previous_signal == 1:  # Sell signal
-                            self.logger.info("SELL SIGNAL DETECTED!")
-                            base_asset = self.symbol.replace('USDT', '')
-                            if balances and base_asset in balances:
-                                self.place_order(SIDE_SELL, self.quantity)
+                    if current_signal == 1 and previous_signal == -1:  # Buy signal
+                        self.logger.info("BUY SIGNAL DETECTED!")
+                        if balances and 'USDT' in balances:
+                            self.place_order(SIDE_BUY, self.quantity)
+                            
+                    elif current_signal == -1 and previous_signal == 1:  # Sell signal
+                        self.logger.info("SELL SIGNAL DETECTED!")
+                        if balances and self.base_asset in balances:
+                            self.place_order(SIDE_SELL, self.quantity)
                 
-                # Wait for next interval
-                self.logger.info("Waiting for next check...")
-                time.sleep(60)  # Check every minute
+                # Wait for next interval, unless a rate limit backoff already waited
+                if self._rate_limited:
+                    self._rate_limited = False
+                else:
+                    self.logger.info("Waiting for next check...")
+                    time.sleep(60)  # Check every minute
                 
             except Exception as e:
                 self.logger.error(f"Error in main loop: {e}")
-                time.sleep(60)  # Wait before retrying
+                self.handle_rate_limit(e)
+                self.wait_before_retry()
 
 # Example usage
 if __name__ == "__main__":
@@ -248,6 +448,6 @@ if __name__ == "__main__":
         api_key=api_key,
         api_secret=api_secret,
         symbol=symbol,
-        interval='1h'
+        interval=KLINE_INTERVAL_1HOUR
     )
     bot.run_bot()